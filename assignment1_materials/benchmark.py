@@ -0,0 +1,241 @@
+"""Benchmark harness for the Solution methods.
+
+Generates synthetic image pairs with ground-truth homographies at several
+resolutions, and synthetic matches with controlled outlier ratios, then times
+and memory-profiles every Solution method. The results are written as JSON
+(one record per measurement) and optionally as log-log scaling plots.
+
+Example:
+    python benchmark.py --resolutions 0.25 1 4 --match-counts 100 10000 \
+        --output bench.json --plot-dir plots
+"""
+import time
+import json
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from scipy.ndimage import zoom
+
+from ex1_student_solution import Solution
+
+
+DEFAULT_RESOLUTIONS_MP = [0.25, 1, 4, 16, 50]
+DEFAULT_MATCH_COUNTS = [10, 100, 1000, 10000, 100000]
+DEFAULT_OUTLIER_RATIOS = [0.0, 0.2, 0.5]
+ASPECT_RATIO = 4 / 3
+
+
+def ground_truth_homography(shape: tuple) -> np.ndarray:
+    """A mild perspective homography which shifts an image by half its width.
+    """
+    rows_num, cols_num = shape[0:2]
+    return np.array([[1.02, 0.03, 0.5 * cols_num],
+                     [-0.02, 1.01, 0.05 * rows_num],
+                     [2e-5 * 1000 / cols_num, 1e-5 * 1000 / rows_num, 1]])
+
+
+def synthetic_image(megapixels: float, rng: np.random.Generator) -> np.ndarray:
+    """A smooth random uint8 RGB texture of about the given size."""
+    rows_num = int(np.sqrt(megapixels * 1e6 / ASPECT_RATIO))
+    cols_num = int(rows_num * ASPECT_RATIO)
+    coarse = rng.uniform(0, 255, size=(rows_num // 16 + 1,
+                                       cols_num // 16 + 1, 3))
+    image = zoom(coarse, (16, 16, 1), order=1)[:rows_num, :cols_num]
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_matches(homography: np.ndarray,
+                      shape: tuple,
+                      match_count: int,
+                      outlier_ratio: float,
+                      rng: np.random.Generator,
+                      noise: float = 0.5) -> tuple:
+    """2xN matching points of the homography, with a ratio of outliers."""
+    rows_num, cols_num = shape[0:2]
+    match_p_src = rng.uniform((0, 0), (cols_num, rows_num),
+                              size=(match_count, 2)).T
+    projected = homography @ np.vstack((match_p_src, np.ones(match_count)))
+    match_p_dst = projected[0:2] / projected[2]
+    match_p_dst += rng.normal(0, noise, size=match_p_dst.shape)
+    outliers = rng.random(match_count) < outlier_ratio
+    match_p_dst[:, outliers] = rng.uniform(
+        (0, 0), (cols_num, rows_num), size=(outliers.sum(), 2)).T
+    return match_p_src, match_p_dst
+
+
+def measure(func, repeat: int, trace_memory: bool) -> dict:
+    """Time a call (best of repeat) and trace its peak allocation."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    record = {'seconds': min(times), 'seconds_all': times}
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return record
+
+
+def homography_cases(match_counts: list, outlier_ratios: list) -> list:
+    """(name, params, func) of the homography estimation benchmarks."""
+    solution = Solution()
+    rng = np.random.default_rng(0)
+    shape = (1000, 1333)
+    homography = ground_truth_homography(shape)
+    cases = []
+    for match_count in match_counts:
+        match_p_src, match_p_dst = synthetic_matches(homography, shape,
+                                                     match_count, 0, rng)
+        cases.append(('compute_homography_naive',
+                      {'matches': match_count},
+                      lambda s=match_p_src, d=match_p_dst:
+                      solution.compute_homography_naive(s, d)))
+        for outlier_ratio in outlier_ratios:
+            match_p_src, match_p_dst = synthetic_matches(
+                homography, shape, match_count, outlier_ratio, rng)
+            inliers_percent = max(0.2, 1 - outlier_ratio - 0.1)
+            for variant, kwargs in [('loop', {}),
+                                    ('batched', {'batched': True,
+                                                 'seed': 0}),
+                                    ('adaptive', {'adaptive': True,
+                                                  'batch_size': 64,
+                                                  'seed': 0})]:
+                cases.append(('compute_homography',
+                              {'matches': match_count,
+                               'outlier_ratio': outlier_ratio,
+                               'variant': variant},
+                              lambda s=match_p_src, d=match_p_dst, k=kwargs,
+                              w=inliers_percent:
+                              solution.compute_homography(s, d, w, 3, **k)))
+    return cases
+
+
+def warp_cases(resolutions: list,
+               slow_max_mp: float,
+               griddata_max_mp: float,
+               untiled_max_mp: float) -> list:
+    """(name, params, func) of the warping and panorama benchmarks.
+
+    The backward warps run tiled at every size, and untiled (with a whole
+    destination warp map) only up to untiled_max_mp.
+    """
+    solution = Solution()
+    rng = np.random.default_rng(0)
+    cases = []
+    for megapixels in resolutions:
+        src_image = synthetic_image(megapixels, rng)
+        dst_image = synthetic_image(megapixels, rng)
+        homography = ground_truth_homography(src_image.shape)
+        backward_homography = np.linalg.inv(homography)
+        match_p_src, match_p_dst = synthetic_matches(
+            homography, src_image.shape, 100, 0.2, rng)
+        params = {'megapixels': megapixels}
+        if megapixels <= slow_max_mp:
+            cases.append(('compute_forward_homography_slow', params,
+                          lambda s=src_image, h=homography:
+                          solution.compute_forward_homography_slow(
+                              h, s, s.shape)))
+        cases.append(('compute_forward_homography_fast', params,
+                      lambda s=src_image, h=homography:
+                      solution.compute_forward_homography_fast(h, s, s.shape)))
+        methods = ['cubic', 'linear', 'nearest']
+        untiled_methods = methods if megapixels <= untiled_max_mp else []
+        if megapixels <= griddata_max_mp:
+            untiled_methods = untiled_methods + ['griddata']
+        for method in untiled_methods:
+            cases.append(('compute_backward_mapping',
+                          dict(params, method=method),
+                          lambda s=src_image, h=backward_homography, m=method:
+                          solution.compute_backward_mapping(h, s, s.shape,
+                                                            method=m)))
+        for method in methods:
+            cases.append(('compute_backward_mapping',
+                          dict(params, method=method, tile_size=512),
+                          lambda s=src_image, h=backward_homography, m=method:
+                          solution.compute_backward_mapping(h, s, s.shape,
+                                                            method=m,
+                                                            tile_size=512)))
+        cases.append(('panorama', params,
+                      lambda s=src_image, d=dst_image, ms=match_p_src,
+                      md=match_p_dst:
+                      solution.panorama(s, d, ms, md, 0.7, 3)))
+    return cases
+
+
+def plot_scaling(records: list, plot_dir: str) -> None:
+    """Plot seconds against the scaling parameter of every benchmark."""
+    import os
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(plot_dir, exist_ok=True)
+    for name in sorted({record['name'] for record in records}):
+        name_records = [record for record in records if record['name'] == name]
+        axis_key = 'megapixels' if 'megapixels' in name_records[0]['params'] \
+            else 'matches'
+        curves = {}
+        for record in name_records:
+            label = ', '.join(f'{key}={value}'
+                              for key, value in record['params'].items()
+                              if key != axis_key) or name
+            curves.setdefault(label, []).append(
+                (record['params'][axis_key], record['seconds']))
+        plt.figure()
+        for label, points in sorted(curves.items()):
+            points.sort()
+            plt.loglog(*zip(*points), marker='o', label=label)
+        plt.xlabel(axis_key)
+        plt.ylabel('seconds')
+        plt.title(name)
+        plt.legend(fontsize='small')
+        plt.savefig(os.path.join(plot_dir, f'{name}.png'))
+        plt.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolutions', type=float, nargs='*',
+                        default=DEFAULT_RESOLUTIONS_MP,
+                        help='image sizes, in megapixels')
+    parser.add_argument('--match-counts', type=int, nargs='*',
+                        default=DEFAULT_MATCH_COUNTS)
+    parser.add_argument('--outlier-ratios', type=float, nargs='*',
+                        default=DEFAULT_OUTLIER_RATIOS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--slow-max-mp', type=float, default=0.25,
+                        help='largest size for the loop-based forward warp')
+    parser.add_argument('--griddata-max-mp', type=float, default=0.25,
+                        help='largest size for the griddata reference warp')
+    parser.add_argument('--untiled-max-mp', type=float, default=4,
+                        help='largest size for the untiled backward warps')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc peak allocation pass')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--plot-dir', default=None)
+    args = parser.parse_args()
+
+    cases = homography_cases(args.match_counts, args.outlier_ratios) + \
+        warp_cases(args.resolutions, args.slow_max_mp, args.griddata_max_mp,
+                   args.untiled_max_mp)
+    records = []
+    for name, params, func in cases:
+        record = {'name': name, 'params': params}
+        record.update(measure(func, args.repeat, not args.no_memory))
+        records.append(record)
+        print('{} {} {:5.4f} sec'.format(name, params, record['seconds']))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(records, output_file, indent=2)
+    print('saved to {}'.format(args.output))
+    if args.plot_dir is not None:
+        plot_scaling(records, args.plot_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Image loading with reduced-scale decoding, prefetching and caching.
+
+Images are decoded straight at a reduced scale where the JPEG codec allows
+it (OpenCV's IMREAD_REDUCED_* modes decode at 1/2, 1/4 or 1/8 of the size by
+skipping the high frequency DCT coefficients) and are then resized to the
+exact decimated size. Decoded images are kept in an LRU cache keyed on
+(path, decimation), and a thread pool decodes the images which will be
+needed next while the current ones are being stitched.
+
+Example:
+    loader = ImageLoader()
+    for src_img, dst_img in loader.iter_pairs([('a.jpg', 'b.jpg'),
+                                               ('c.jpg', 'd.jpg')], 5.0):
+        ...
+"""
+import threading
+
+import numpy as np
+
+from typing import Iterable, Iterator, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+# images are decoded in their stored frame, as matplotlib.image.imread does,
+# since the EXIF orientation would rotate them away from their JPEG header
+# size and from the frame their matching points were picked in
+IMREAD_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+# the reduced decoding modes, by their scale denominator
+REDUCED_MODES = [(8, cv2.IMREAD_REDUCED_COLOR_8 | cv2.IMREAD_IGNORE_ORIENTATION),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2 | cv2.IMREAD_IGNORE_ORIENTATION)]
+
+
+def decode_image(path: str, decimation: float = 1.0) -> np.ndarray:
+    """Decode an RGB image, decimated by a factor.
+
+    JPEGs are decoded at the largest reduced scale not finer than the
+    decimation; other images are decoded in full. The image is then resized
+    with INTER_CUBIC to (int(width / decimation), int(height / decimation)),
+    the size your_images_loader in main.py resizes to.
+
+    Args:
+        path: the image file.
+        decimation: the factor by which both sides are divided.
+
+    Returns:
+        HxWx3 uint8 RGB image.
+    """
+    if decimation < 1:
+        raise ValueError('decimation must be at least 1')
+    # the full size is known from the header of JPEGs only, which are also
+    # the only images OpenCV can decode at a reduced scale
+    full_size = image_size(path) if decimation > 1 else None
+    flags = IMREAD_FLAGS
+    if full_size is not None:
+        for reduction, reduced_flags in REDUCED_MODES:
+            if decimation >= reduction:
+                flags = reduced_flags
+                break
+    image = cv2.imread(path, flags)
+    if image is None:
+        raise FileNotFoundError(f'Cannot decode {path}')
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if decimation == 1:
+        return image
+
+    if full_size is None:
+        full_size = (image.shape[1], image.shape[0])
+    dsize = (int(full_size[0] / decimation), int(full_size[1] / decimation))
+    if dsize != (image.shape[1], image.shape[0]):
+        image = cv2.resize(image, dsize=dsize, interpolation=cv2.INTER_CUBIC)
+    return image
+
+
+def image_size(path: str):
+    """The (width, height) of a JPEG from its header, None if not a JPEG."""
+    try:
+        image_file = open(path, 'rb')
+    except OSError:
+        return None
+    with image_file:
+        if image_file.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = image_file.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            if marker[1] in (0xd8, 0x01) or 0xd0 <= marker[1] <= 0xd7:
+                continue
+            length = int.from_bytes(image_file.read(2), 'big')
+            # start of frame markers, except DHT, JPG and DAC
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                segment = image_file.read(5)
+                return int.from_bytes(segment[3:5], 'big'), int.from_bytes(segment[1:3], 'big')
+            image_file.seek(length - 2, 1)
+
+
+class ImageLoader:
+    """Decode images on a background thread pool, with an LRU cache.
+
+    The decoded images are read-only, since they are shared by every caller
+    which loads the same (path, decimation).
+    """
+
+    def __init__(self, max_bytes: int = 1 << 29, workers: int = 2):
+        """Create a loader.
+
+        Args:
+            max_bytes: the budget of the decoded image cache.
+            workers: the number of decoding threads.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _decode(self, key: tuple) -> np.ndarray:
+        image = decode_image(*key)
+        image.flags.writeable = False
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._cache:
+                return self._cache[key]
+            if image.nbytes <= self.max_bytes:
+                self._cache[key] = image
+                self.nbytes += image.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return image
+
+    def prefetch(self, items: Iterable[Tuple[str, float]]) -> None:
+        """Start decoding images in the background.
+
+        Args:
+            items: (path, decimation) tuples.
+        """
+        with self._lock:
+            for path, decimation in items:
+                key = (path, float(decimation))
+                if key not in self._cache and key not in self._pending:
+                    self._pending[key] = self._pool.submit(self._decode, key)
+
+    def load(self, path: str, decimation: float = 1.0) -> np.ndarray:
+        """Decode an image, or take it from the cache or from a prefetch.
+
+        Args:
+            path: the image file.
+            decimation: the factor by which both sides are divided.
+
+        Returns:
+            A read-only HxWx3 uint8 RGB image.
+        """
+        key = (path, float(decimation))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        return self._decode(key)
+
+    def iter_pairs(self,
+                   pairs: Iterable[Tuple[str, str]],
+                   decimation: float = 1.0,
+                   prefetch: int = 2) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Load pairs of images, decoding the next ones in the background.
+
+        Args:
+            pairs: (src_path, dst_path) tuples.
+            decimation: the factor by which both sides are divided.
+            prefetch: the number of pairs decoded ahead.
+
+        Yields:
+            (src_image, dst_image) tuples.
+        """
+        pairs = list(pairs)
+        for idx, (src_path, dst_path) in enumerate(pairs):
+            self.prefetch((path, decimation) for pair in pairs[idx:idx + 1 + prefetch] for path in pair)
+            yield self.load(src_path, decimation), self.load(dst_path, decimation)
+
+    def clear(self) -> None:
+        """Drop every cached image."""
+        with self._lock:
+            self._cache.clear()
+            self.nbytes = 0
+
+    def close(self) -> None:
+        """Stop the decoding threads."""
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
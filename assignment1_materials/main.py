@@ -1,12 +1,13 @@
+import os
 import time
 import scipy.io
 import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 
-from cv2 import resize, INTER_CUBIC
 from matplotlib.patches import Circle
 
 from ex1_student_solution import Solution
+from match_store import MatchStore
+from image_loader import ImageLoader
 
 
 ##########################################################
@@ -25,23 +26,43 @@ def toc(t):
     return float(tic()) - float(t)
 
 
+# optional store of all the matches, see match_store.py:
+# python match_store.py matches.mstore matches.mat matches_perfect.mat matches_test.mat
+MATCH_STORE = 'matches.mstore'
+
+DECIMATION_FACTOR = 5.0
+# decodes (at reduced scale) and caches the images, prefetching in the background
+IMAGE_LOADER = ImageLoader()
+
+
+def load_matches(name):
+    """Load 2xN float matches from the match store, or else from name.mat"""
+    if os.path.exists(MATCH_STORE):
+        store = MatchStore(MATCH_STORE)
+        if name in store:
+            return store[name]
+    matches = scipy.io.loadmat(name)
+    return matches['match_p_src'].astype(float), matches['match_p_dst'].astype(float)
+
+
 def load_data(is_perfect_matches=True):
     # Read the data:
-    src_img = mpimg.imread('src.jpg')
-    dst_img = mpimg.imread('dst.jpg')
+    src_img = IMAGE_LOADER.load('src.jpg')
+    dst_img = IMAGE_LOADER.load('dst.jpg')
     if is_perfect_matches:
         # loading perfect matches
-        matches = scipy.io.loadmat('matches_perfect')
+        match_p_src, match_p_dst = load_matches('matches_perfect')
     else:
         # matching points and some outliers
-        matches = scipy.io.loadmat('matches')
-    match_p_dst = matches['match_p_dst'].astype(float)
-    match_p_src = matches['match_p_src'].astype(float)
+        match_p_src, match_p_dst = load_matches('matches')
     return src_img, dst_img, match_p_src, match_p_dst
 
 
 def main():
     solution = Solution()
+    # decode the student images in the background while the first part runs
+    IMAGE_LOADER.prefetch([('src_test.jpg', DECIMATION_FACTOR),
+                           ('dst_test.jpg', DECIMATION_FACTOR)])
     # Parameters
     max_err = 25
     inliers_percent = 0.8
@@ -151,26 +172,14 @@ def main():
 
 
 def your_images_loader():
-    src_img_test = mpimg.imread('src_test.jpg')
-    dst_img_test = mpimg.imread('dst_test.jpg')
-
-    DECIMATION_FACTOR = 5.0
-    src_img_test = resize(src_img_test,
-                          dsize=(int(src_img_test.shape[1]/DECIMATION_FACTOR),
-                                 int(src_img_test.shape[0]/DECIMATION_FACTOR)),
-                          interpolation=INTER_CUBIC)
-    dst_img_test = resize(dst_img_test,
-                          dsize=(int(dst_img_test.shape[1]/DECIMATION_FACTOR),
-                                 int(dst_img_test.shape[0]/DECIMATION_FACTOR)),
-                          interpolation=INTER_CUBIC)
-
-    matches_test = scipy.io.loadmat('matches_test')
-
-    match_p_dst = matches_test['match_p_dst'].astype(float)
-    match_p_src = matches_test['match_p_src'].astype(float)
-
-    match_p_dst /= DECIMATION_FACTOR
-    match_p_src /= DECIMATION_FACTOR
+    # decoded at reduced scale and resized to (int(width/DECIMATION_FACTOR), int(height/DECIMATION_FACTOR))
+    src_img_test = IMAGE_LOADER.load('src_test.jpg', DECIMATION_FACTOR)
+    dst_img_test = IMAGE_LOADER.load('dst_test.jpg', DECIMATION_FACTOR)
+
+    match_p_src, match_p_dst = load_matches('matches_test')
+
+    match_p_dst = match_p_dst / DECIMATION_FACTOR
+    match_p_src = match_p_src / DECIMATION_FACTOR
     return src_img_test, dst_img_test, match_p_src, match_p_dst
 
 
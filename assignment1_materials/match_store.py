@@ -0,0 +1,170 @@
+"""Compact binary store of many sets of matching points.
+
+A store is a single file which holds any number of (match_p_src,
+match_p_dst) pairs of 2xN points:
+
+    magic (8 bytes) | header length (uint64) | JSON header | padding
+    offsets ((P + 1) int64) | padding
+    points (2 x 2 x T of the header dtype)
+
+The points of all the pairs are concatenated along the last axis, so pair i
+is points[:, :, offsets[i]:offsets[i + 1]] and its source and destination
+points are 2xN views of the memory-mapped file; opening a store and
+slicing a pair out of it involves no parsing and no copy.
+
+Example:
+    python match_store.py matches.mstore matches.mat matches_perfect.mat
+"""
+import json
+import argparse
+
+import numpy as np
+
+from typing import Iterable, Optional, Tuple
+
+import scipy.io
+
+
+MAGIC = b'\x93MSTORE\x01'
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_matches(path: str,
+                  pairs: list,
+                  names: Optional[list] = None,
+                  dtype=np.float64) -> None:
+    """Write pairs of matching points to a new store.
+
+    Args:
+        path: the store file, overwritten if it exists.
+        pairs: list of (match_p_src, match_p_dst) tuples of 2xN points; N
+        may differ between pairs.
+        names: optional list of unique names of the pairs.
+        dtype: the dtype of the stored points.
+    """
+    if names is not None and (len(names) != len(pairs) or len(set(names)) != len(names)):
+        raise ValueError('Expected one unique name per pair')
+    counts = [np.shape(match_p_src)[1] for match_p_src, _ in pairs]
+    offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    header = json.dumps({'version': 1,
+                         'dtype': np.dtype(dtype).str,
+                         'pairs': len(pairs),
+                         'total': int(offsets[-1]),
+                         'names': names}).encode()
+    offsets_start = _aligned(len(MAGIC) + 8 + len(header))
+    points_start = _aligned(offsets_start + offsets.nbytes)
+
+    with open(path, 'wb') as store_file:
+        store_file.write(MAGIC)
+        store_file.write(np.uint64(len(header)).tobytes())
+        store_file.write(header)
+        store_file.seek(offsets_start)
+        store_file.write(offsets.tobytes())
+        store_file.truncate(points_start + 4 * int(offsets[-1]) * np.dtype(dtype).itemsize)
+    if offsets[-1] == 0:
+        return
+    points = np.memmap(path, dtype=dtype, mode='r+', offset=points_start,
+                       shape=(2, 2, int(offsets[-1])))
+    for (match_p_src, match_p_dst), first, last in zip(pairs, offsets[:-1], offsets[1:]):
+        points[0, :, first:last] = match_p_src
+        points[1, :, first:last] = match_p_dst
+    points.flush()
+    del points
+
+
+class MatchStore:
+    """A read-only, memory-mapped store of pairs of matching points.
+
+    Pairs are indexed by position or by name, and are returned as 2xN
+    views of the file (read-only arrays of the store dtype).
+    """
+
+    def __init__(self, path: str):
+        """Open a store written by write_matches.
+
+        Args:
+            path: the store file.
+        """
+        with open(path, 'rb') as store_file:
+            if store_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a match store')
+            header_len = int(np.frombuffer(store_file.read(8), dtype=np.uint64)[0])
+            header = json.loads(store_file.read(header_len))
+        if header['version'] != 1:
+            raise ValueError(f'Unsupported match store version {header["version"]}')
+        offsets_start = _aligned(len(MAGIC) + 8 + header_len)
+        self.offsets = np.memmap(path, dtype=np.int64, mode='r', offset=offsets_start,
+                                 shape=(header['pairs'] + 1,))
+        if header['total'] > 0:
+            self.points = np.memmap(path, dtype=np.dtype(header['dtype']), mode='r',
+                                    offset=_aligned(offsets_start + self.offsets.nbytes),
+                                    shape=(2, 2, header['total']))
+        else:
+            self.points = np.empty((2, 2, 0), dtype=np.dtype(header['dtype']))
+        self.names = header['names']
+        self._name_idx = {name: idx for idx, name in enumerate(self.names or [])}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key) -> Tuple[np.ndarray, np.ndarray]:
+        """The (match_p_src, match_p_dst) 2xN views of a pair.
+
+        Args:
+            key: the index or the name of the pair.
+        """
+        if isinstance(key, str):
+            if key not in self._name_idx:
+                raise KeyError(key)
+            key = self._name_idx[key]
+        if not -len(self) <= key < len(self):
+            raise IndexError(key)
+        key %= len(self)
+        first, last = self.offsets[key], self.offsets[key + 1]
+        return self.points[0, :, first:last], self.points[1, :, first:last]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_idx
+
+    def __iter__(self) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def counts(self) -> np.ndarray:
+        """The number of matching points of every pair."""
+        return np.diff(self.offsets)
+
+
+def convert_mat_files(path: str, mat_paths: list) -> None:
+    """Write the matches of .mat files to a store, named after the files.
+
+    Args:
+        path: the store file.
+        mat_paths: .mat files holding 'match_p_src' and 'match_p_dst', as
+        written by create_matching_points.py.
+    """
+    pairs = []
+    names = []
+    for mat_path in mat_paths:
+        matches = scipy.io.loadmat(mat_path)
+        pairs.append((matches['match_p_src'].astype(float), matches['match_p_dst'].astype(float)))
+        names.append(mat_path[:-len('.mat')] if mat_path.endswith('.mat') else mat_path)
+    write_matches(path, pairs, names=names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert .mat matching points to a match store.')
+    parser.add_argument('store', help='the store file to write')
+    parser.add_argument('mat_files', nargs='+')
+    args = parser.parse_args()
+    convert_mat_files(args.store, args.mat_files)
+    print('saved {} pairs to {}'.format(len(args.mat_files), args.store))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Headless batch stitching of many image pairs.
+
+Reads a manifest of jobs, stitches every pair with Solution.panorama on a
+process pool and writes the panoramas to disk. A job is only started when
+the estimated memory of the running jobs leaves room for it, so a batch of
+large images cannot exhaust the memory of the machine. A throughput report
+is printed, and optionally written as JSON with one record per job.
+
+The manifest is a JSON list (or a file of JSON lines) of jobs:
+
+    {"src": "src.jpg", "dst": "dst.jpg", "matches": "matches.mat",
+     "output": "pano.png"}
+
+where matches is a .mat file (as written by create_matching_points.py) or a
+match store (see match_store.py) together with a "pair" name or index.
+The output defaults to <output-dir>/<job index>.png.
+
+Example:
+    python stitch_batch.py jobs.json --workers 4 --memory-limit 8000 \
+        --output-dir panoramas --report report.json
+"""
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import scipy.io
+
+from PIL import Image
+
+from ex1_student_solution import Solution
+from image_loader import decode_image, image_size
+from match_store import MatchStore
+
+
+# bytes per pixel of both input images kept by a job: the decoded images
+# and a panorama canvas of up to twice their area, with its mask
+BYTES_PER_INPUT_PIXEL = 3 + 2 * (3 + 1)
+# the temporaries of one 512x512 cubic backward warp tile
+TILE_BYTES = 512 * 512 * 16 * (8 + 8)
+TILE_SIZE = 512
+
+
+def read_manifest(path: str) -> list:
+    """The jobs of a JSON list or JSON lines manifest."""
+    with open(path) as manifest_file:
+        text = manifest_file.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def estimate_job_bytes(job: dict, decimation: float) -> int:
+    """The estimated peak memory of a job, from the sizes of its images."""
+    pixels_num = 0
+    for path in (job['src'], job['dst']):
+        size = image_size(path) if os.path.exists(path) else None
+        if size is None:
+            # not a JPEG: read the size from the header (unreadable images fail in run_job)
+            try:
+                with Image.open(path) as image:
+                    size = image.size
+            except OSError:
+                size = (0, 0)
+        pixels_num += (size[0] // decimation) * (size[1] // decimation)
+    return int(pixels_num * BYTES_PER_INPUT_PIXEL + TILE_BYTES)
+
+
+def load_job_matches(job: dict) -> tuple:
+    """The 2xN float (match_p_src, match_p_dst) of a job."""
+    if job['matches'].endswith('.mat'):
+        matches = scipy.io.loadmat(job['matches'])
+        return matches['match_p_src'].astype(float), matches['match_p_dst'].astype(float)
+    return MatchStore(job['matches'])[job.get('pair', 0)]
+
+
+def run_job(job: dict, options: dict) -> dict:
+    """Stitch the pair of a job and write the panorama.
+
+    Args:
+        job: a manifest entry, with its output path resolved.
+        options: the inliers_percent, max_err, decimation, seed and blend
+        of the batch.
+
+    Returns:
+        A record of the job, with its timing, or its error.
+    """
+    record = {'src': job['src'], 'dst': job['dst'], 'output': job['output'], 'pid': os.getpid()}
+    start = time.perf_counter()
+    try:
+        src_img = decode_image(job['src'], options['decimation'])
+        dst_img = decode_image(job['dst'], options['decimation'])
+        match_p_src, match_p_dst = load_job_matches(job)
+        match_p_src = match_p_src / options['decimation']
+        match_p_dst = match_p_dst / options['decimation']
+        record['load_seconds'] = time.perf_counter() - start
+
+        ransac_kwargs = {} if options['seed'] is None else {'batched': True, 'seed': options['seed']}
+        panorama = Solution().panorama(src_img, dst_img, match_p_src, match_p_dst, options['inliers_percent'],
+                                       options['max_err'], tile_size=TILE_SIZE, ransac_kwargs=ransac_kwargs,
+                                       blend=options['blend'])
+        record['stitch_seconds'] = time.perf_counter() - start - record['load_seconds']
+
+        output_dir = os.path.dirname(job['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if job['output'].endswith('.npy'):
+            np.save(job['output'], panorama)
+        elif not cv2.imwrite(job['output'], cv2.cvtColor(panorama, cv2.COLOR_RGB2BGR)):
+            raise IOError(f'Cannot write {job["output"]}')
+        record['shape'] = list(panorama.shape)
+        record['megapixels'] = panorama.shape[0] * panorama.shape[1] / 1e6
+    except Exception as error:
+        record['error'] = f'{type(error).__name__}: {error}'
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def failed_record(job: dict, error: Exception) -> dict:
+    """The record of a job whose worker failed."""
+    return {'src': job['src'], 'dst': job['dst'], 'output': job['output'], 'seconds': 0.0,
+            'error': f'{type(error).__name__}: {error}'}
+
+
+def run_batch(jobs: list, options: dict, workers: int, memory_limit: int) -> list:
+    """Run the jobs on a process pool, admitting them by estimated memory.
+
+    A job is submitted only while the estimates of the running jobs and its
+    own fit in memory_limit; a job larger than the limit runs alone. When a
+    worker dies (e.g. killed by the out-of-memory killer) the results of
+    the jobs which finished are kept, the jobs which did not finish are
+    recorded as failed and the pool is restarted, so the rest of the batch
+    still runs.
+
+    Returns:
+        The records of the jobs, in the order of the manifest.
+    """
+    estimates = [estimate_job_bytes(job, options['decimation']) for job in jobs]
+    records = [None] * len(jobs)
+    running = {}
+    next_job = 0
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while next_job < len(jobs) or running:
+            in_use = sum(estimates[idx] for idx in running.values())
+            while next_job < len(jobs) and len(running) < workers and \
+                    (not running or in_use + estimates[next_job] <= memory_limit):
+                running[pool.submit(run_job, jobs[next_job], options)] = next_job
+                in_use += estimates[next_job]
+                next_job += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            finished = []
+            broken = None
+            for future in done:
+                if future.exception() is None:
+                    finished.append((running.pop(future), future.result()))
+                elif isinstance(future.exception(), BrokenProcessPool):
+                    broken = future.exception()
+                else:
+                    raise future.exception()
+            if broken is not None:
+                # a dead worker breaks the whole pool: fail the jobs which did not finish and restart it
+                for idx in running.values():
+                    finished.append((idx, failed_record(jobs[idx], broken)))
+                running.clear()
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=workers)
+            for idx, record in finished:
+                records[idx] = record
+                records[idx]['estimated_bytes'] = estimates[idx]
+                print('{} {} {:5.4f} sec'.format(idx, record.get('error', record['output']), record['seconds']))
+    finally:
+        pool.shutdown(wait=True)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('manifest', help='JSON list or JSON lines of jobs')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--memory-limit', type=float, default=4096,
+                        help='budget of the running jobs, in MB')
+    parser.add_argument('--output-dir', default='panoramas')
+    parser.add_argument('--inliers-percent', type=float, default=0.8)
+    parser.add_argument('--max-err', type=float, default=25)
+    parser.add_argument('--decimation', type=float, default=1.0,
+                        help='factor by which the images and matches are scaled down')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the (batched) RANSAC, for reproducible panoramas')
+    parser.add_argument('--blend', choices=['feather', 'multiband'], default=None)
+    parser.add_argument('--report', default=None, help='JSON file of the job records')
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    for idx, job in enumerate(jobs):
+        job.setdefault('output', os.path.join(args.output_dir, f'{idx}.png'))
+    options = {'inliers_percent': args.inliers_percent, 'max_err': args.max_err,
+               'decimation': args.decimation, 'seed': args.seed, 'blend': args.blend}
+
+    start = time.perf_counter()
+    records = run_batch(jobs, options, max(1, args.workers), int(args.memory_limit * 2 ** 20))
+    seconds = time.perf_counter() - start
+
+    succeeded = [record for record in records if 'error' not in record]
+    megapixels = sum(record['megapixels'] for record in succeeded)
+    report = {'jobs': len(records), 'succeeded': len(succeeded), 'failed': len(records) - len(succeeded),
+              'seconds': seconds, 'jobs_per_second': len(succeeded) / seconds,
+              'megapixels_per_second': megapixels / seconds, 'records': records}
+    print('{} of {} panoramas in {:5.4f} sec: {:.3f} panoramas/sec, {:.3f} MP/sec'.format(
+        report['succeeded'], report['jobs'], seconds, report['jobs_per_second'], report['megapixels_per_second']))
+    if args.report is not None:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print('saved to {}'.format(args.report))
+
+
+if __name__ == '__main__':
+    main()